@@ -1,33 +1,52 @@
 import subprocess
 import argparse
 import re
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+VERSION_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".adb_runner_cache.json")
+# Cached versions are fetched again after a day, so system updates are picked up
+VERSION_CACHE_TTL = 24 * 60 * 60
+VERSION_CLEANUP_RE = re.compile(r"[^\d.]")
+# "<udid>\t<state>" lines of adb devices; the header and daemon notices have more columns and never match
+DEVICE_LINE_RE = re.compile(r"^(\S+)[ \t]+(\S+)[ \t\r]*$", re.MULTILINE)
+# [android_version, fetched_at] pairs already known, keyed by device UDID
+version_cache = {}
 
 def inline_cmd(comando):
     """
     Runs commands inline, returning an error or an output.
     """
-    process = subprocess.Popen(comando, shell=True, stdout=subprocess.PIPE)
-    output, err = process.communicate()
-    if err:
-        print(f"Error executing command: {err}")
+    try:
+        process = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, err = process.communicate()
+    except OSError as e:
+        print(f"Error executing command: {e}")
+        return None
+    # adb prints notices such as "* daemon not running" to stderr, so only a non-zero exit is an error
+    if process.returncode != 0:
+        print(f"Error executing command: {err.decode('utf-8', errors='replace').strip()}")
         return None
-    return output
+    return output.decode("utf-8", errors="replace")
 
 def get_udids():
     """
     Runs adb devices command and filter the result to obtain a list of Android devices connected to ADB.
     """
-    cmd = "adb devices"
+    cmd = ["adb", "devices"]
     devices = inline_cmd(cmd)
     print("Identifying Android devices connected to the computer...\n\n")
-    lines = devices.decode("utf-8").splitlines()
+    if devices is None:
+        return []
     udids = []
-    for line in lines:
-        if "List of devices attached" in line:
-            continue
-        parts = line.split()
-        if len(parts) == 2 and parts[1] != "offline" and parts[1] != "unauthorized":
-            udids.append(parts[0])
+    for udid, state in DEVICE_LINE_RE.findall(devices):
+        if state == "offline" or state == "unauthorized":
+            # The device may come back with another build, so its version is fetched again next time
+            version_cache.pop(udid, None)
+        else:
+            udids.append(udid)
     print(udids)
     print("\n==================================================")
     return udids
@@ -35,19 +54,58 @@ def get_udids():
 def get_android_version(udid):
     """
     Runs adb shell getprop command and filter the result to abtain the device's Android version.
+    Versions already known from the cache are returned without running the command.
     """
-    print(f"\n\nDISPOSTIVO {udid}:")
-    cmd = f"adb -s {udid} shell getprop ro.build.version.release"
+    cached = version_cache.get(udid)
+    if is_fresh_cache_entry(cached):
+        return cached[0]
+    cmd = ["adb", "-s", udid, "shell", "getprop", "ro.build.version.release"]
     android_version = inline_cmd(cmd)
-    print(f"\nIdentifying device Android version...")
-    version_numbers = re.sub(r"[^\d\.]", "", android_version.decode("utf-8"))
+    if android_version is None:
+        return ""
+    version_numbers = android_version.strip()
+    # getprop usually prints a clean version already, so the regex is only needed for unexpected output
+    if not version_numbers.replace(".", "").isdigit():
+        version_numbers = VERSION_CLEANUP_RE.sub("", version_numbers)
+    if version_numbers:
+        version_cache[udid] = [version_numbers, time.time()]
     return version_numbers
 
+def is_fresh_cache_entry(entry):
+    """
+    Checks that a cache entry is an [android_version, fetched_at] pair that has not expired yet.
+    """
+    return (isinstance(entry, list) and len(entry) == 2 and isinstance(entry[0], str)
+            and isinstance(entry[1], (int, float)) and time.time() - entry[1] < VERSION_CACHE_TTL)
+
+def load_version_cache():
+    """
+    Loads the Android versions saved by previous runs, so known devices skip the getprop round-trip.
+    """
+    try:
+        with open(VERSION_CACHE_FILE, "r", encoding="utf-8") as file:
+            saved_cache = json.load(file)
+    except (OSError, ValueError):
+        return
+    if isinstance(saved_cache, dict):
+        version_cache.update((udid, entry) for udid, entry in saved_cache.items() if is_fresh_cache_entry(entry))
+
+def save_version_cache():
+    """
+    Saves the known Android versions to be reused by the next run.
+    """
+    try:
+        with open(VERSION_CACHE_FILE, "w", encoding="utf-8") as file:
+            json.dump({udid: entry for udid, entry in version_cache.items() if is_fresh_cache_entry(entry)}, file)
+    except OSError:
+        pass
+
 def open_cmd_window(comando):
     """
     Runs command on another cmd window, independently. That means that the script does not wait for the command to finish execution.
     """
-    subprocess.run(["start", "cmd", "/K", comando], shell=True, creationflags=subprocess.DETACHED_PROCESS|subprocess.CREATE_BREAKAWAY_FROM_JOB)
+    # cmd gets its own console directly, so no intermediate shell is needed to run "start"
+    subprocess.Popen(["cmd", "/K", comando], creationflags=subprocess.CREATE_NEW_CONSOLE|subprocess.CREATE_BREAKAWAY_FROM_JOB)
 
 def run_command(udids, command):
     """
@@ -56,26 +114,36 @@ def run_command(udids, command):
     """
     print(f"\nStarting ADB Runner script\n")
     print("==================================================")
-    for udid in udids:
-        android_version = get_android_version(udid)
-        print(f"Android {android_version}!")
-        # The execution command is located here:
-        my_command = f"echo {udid} - Android {android_version} && {command}"
-        print(f"Running your command on this device in another window...")
-        open_cmd_window(my_command)
-        print(f"Check your command execution in the separate cmd window\n\n")
-        print("==================================================")
+    print(f"\nIdentifying devices Android version...")
+    # getprop round-trips are I/O bound, so query every device at once instead of one after another
+    with ThreadPoolExecutor(max_workers=min(32, len(udids))) as executor:
+        android_versions = executor.map(get_android_version, udids)
+        for udid, android_version in zip(udids, android_versions):
+            print(f"\n\nDISPOSTIVO {udid}:")
+            print(f"Android {android_version}!")
+            # The execution command is located here:
+            my_command = f"echo {udid} - Android {android_version} && {command}"
+            print(f"Running your command on this device in another window...")
+            open_cmd_window(my_command)
+            print(f"Check your command execution in the separate cmd window\n\n")
+            print("==================================================")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run a command on all ADB connected devices.")
     parser.add_argument("-c", "--command", required=True, help="Command to run")
+    parser.add_argument("-r", "--rescan", action="store_true", help="Ignore cached Android versions and query the devices again")
     # If you need more arguments, you can add them here. Don't forget to pass them in the run_command() function below.
     args = parser.parse_args()
 
+    load_version_cache()
     udids = get_udids()
+    if args.rescan:
+        for udid in udids:
+            version_cache.pop(udid, None)
     if udids:
         run_command(udids, args.command)
     else:
         print("No Android devices connected or online on ADB.")
+    save_version_cache()
     print("\n\nPress any key to exit...")
     input()